@@ -3,10 +3,9 @@ import torch.nn.functional as F
 from ..builder import HEADS
 import torch
 from .decode_head import BaseDecodeHead
-import numpy as np
 from mmcv.cnn import ConvModule, xavier_init, constant_init
+from mmseg.models.utils import attention_pool, gated_sum
 from .lib.axial_attention import AA_kernel
-torch.autograd.set_detect_anomaly(True)
 
 
 
@@ -21,28 +20,22 @@ class BNPReLU(nn.Module):
         output = self.acti(output)
 
         return output
+
+
 class ScaleBranch(nn.Module):
 
     def __init__(self, in_channels=256, out_channels=256):
         super(ScaleBranch, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
-        self.spatialPooling = nn.AdaptiveAvgPool3d((4, 1, 1))
-        self.scalePooling = nn.AdaptiveAvgPool2d(1)
         self.channel_agg = nn.Conv2d(in_channels, 1, kernel_size=1)
         self.trans = nn.Conv2d(self.in_channels, self.out_channels, 1)
 
     def forward(self, x):
-        x = self.spatialPooling(x.permute(0, 2, 1, 3, 4)).reshape(
-            x.size(0), x.size(2), 4, 1)
-        batch, channel, height, width = x.size()
-        channel_context = self.channel_agg(x)
-        channel_context = channel_context.view(batch, 1, height * width)
-        channel_context = F.softmax(channel_context, dim=-1)
-        channel_context = channel_context * height * width
-        channel_context = channel_context.view(batch, 1, height, width)
-        context = self.scalePooling(x * channel_context)
-        context = self.trans(context).unsqueeze(0)
+        # B, S, C, H, W -> B, C, S, 1
+        x = x.mean(dim=(3, 4)).transpose(1, 2).unsqueeze(-1)
+        context = attention_pool(x, self.channel_agg(x))
+        context = self.trans(context)
         return context
 
 
@@ -52,21 +45,13 @@ class SpatialBranch(nn.Module):
         super(SpatialBranch, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
-        self.scalePooling = nn.AvgPool3d((4, 1, 1))
-        self.spatialPooling = nn.AdaptiveAvgPool2d(1)
         self.channel_agg = nn.Conv2d(in_channels, 1, kernel_size=1)
         self.trans = nn.Conv2d(self.in_channels, self.out_channels, 1)
 
     def forward(self, x):
-        x = self.scalePooling(x.permute(0, 2, 1, 3, 4)).squeeze(2)
-        batch, channel, height, width = x.size()
-        channel_context = self.channel_agg(x)
-        channel_context = channel_context.view(batch, 1, height * width)
-        channel_context = F.softmax(channel_context, dim=-1)
-        channel_context = channel_context * height * width
-        channel_context = channel_context.view(batch, 1, height, width)
-        context = self.spatialPooling(x * channel_context)
-        context = self.trans(context).unsqueeze(0)
+        x = x.mean(dim=1)
+        context = attention_pool(x, self.channel_agg(x))
+        context = self.trans(context)
         return context
 class FusionNode(nn.Module):
 
@@ -89,25 +74,20 @@ class FusionNode(nn.Module):
         act_cfg = None
         self.act_cfg = act_cfg
 
-        self.gap = nn.AdaptiveAvgPool2d(1)
         self.weight = nn.Conv2d(in_channels * 2, 1, kernel_size=1, bias=True)
         constant_init(self.weight, 0)
 
         self.fusion = nn.ModuleList()
         for i in range(op_num-1):
             self.fusion.append(ConvModule(in_channels*2, in_channels, kernel_size=1, norm_cfg=out_norm_cfg, order=out_conv_order))
-            for m in self.fusion[-1].modules():
-                if isinstance(m, nn.Conv2d):
-                    xavier_init(m, distribution='uniform')
+            xavier_init(self.fusion[-1].conv, distribution='uniform')
 
         if self.upsample_attn:
             self.spatial_weight = nn.Conv2d(
                 in_channels * 2, 1, kernel_size=3, padding=1, bias=True)
             self.temp = nn.Parameter(
                 torch.ones(1, dtype=torch.float32), requires_grad=True)
-            for m in self.spatial_weight.modules():
-                if isinstance(m, nn.Conv2d):
-                    constant_init(m, 0)
+            constant_init(self.spatial_weight, 0)
 
         # if self.with_out_conv:
         #     self.post_fusion = ConvModule(
@@ -133,9 +113,7 @@ class FusionNode(nn.Module):
                 norm_cfg=out_norm_cfg,
                 order=('act', 'conv', 'norm'))
             if out_conv_cfg is None or out_conv_cfg['type'] == 'Conv2d':
-                for m in self.post_fusion.modules():
-                    if isinstance(m, nn.Conv2d):
-                        xavier_init(m, distribution='uniform')
+                xavier_init(self.post_fusion.conv, distribution='uniform')
 
     def dynamicFusion(self, x):
         x1, x2 = x[0], x[1]
@@ -155,12 +133,12 @@ class FusionNode(nn.Module):
             f_1 = result
             f_2 = self.fusion[1](torch.cat([x2, x3], dim=1))
 
-            weight1 = self.gap(f_1)
-            weight3 = self.gap(f_2)
+            weight1 = f_1.mean(dim=(2, 3), keepdim=True)
+            weight3 = f_2.mean(dim=(2, 3), keepdim=True)
             weight = torch.cat((weight1, weight3), dim=1)
             weight = self.weight(weight)
             weight = torch.sigmoid(weight)
-            result = weight * f_1 + (1 - weight) * f_2
+            result = gated_sum(f_1, f_2, weight)
             if self.with_out_conv:
                 result = self.post_fusion(result)
         return result
@@ -171,16 +149,10 @@ class FusionNode(nn.Module):
         elif x.shape[-2:] < size:
             return F.interpolate(x, size=size, mode=self.upsample_mode)
         else:
-            _, _, h, w = x.size()
-            x = F.max_pool2d(
-                F.pad(x, [0, w % 2, 0, h % 2], 'replicate'), (2, 2))
-            return x
+            return F.max_pool2d(x, kernel_size=2, stride=2, ceil_mode=True)
 
     def forward(self, x, out_size=None):
-        inputs = []
-        for feat in x:
-            inputs.append(self._resize(feat, out_size))
-        return self.dynamicFusion(inputs)
+        return self.dynamicFusion([self._resize(feat, out_size) for feat in x])
 
     
 @HEADS.register_module()
@@ -258,10 +230,7 @@ class RPPHead(BaseDecodeHead):
         elif x.shape[-2:] < size:
             return F.interpolate(x, size=size, mode="bilinear", align_corners=False)
         else:
-            _, _, h, w = x.size()
-            x = F.max_pool2d(
-                F.pad(x, [0, w % 2, 0, h % 2], 'replicate'), (2, 2))
-            return x
+            return F.max_pool2d(x, kernel_size=2, stride=2, ceil_mode=True)
 
 
     def forward(self, inputs):
@@ -280,7 +249,9 @@ class RPPHead(BaseDecodeHead):
         # fixed order 
         output = torch.cat([c3.unsqueeze(1), c4.unsqueeze(1), c5.unsqueeze(1), c6.unsqueeze(1)], dim=1)  # B*4*C*H*W
         
-        output = output.permute(1, 0, 2, 3, 4) + self.spatialContext(output) + self.scaleContext(output)    
+        # B*C*1*1 contexts broadcast over the leading scale dim
+        context = self.spatialContext(output) + self.scaleContext(output)
+        output = output.permute(1, 0, 2, 3, 4) + context
         
         list_p = [c3, c4, c5, c6]
         for i in range(4):
@@ -3,13 +3,11 @@ import torch.nn.functional as F
 from ..builder import HEADS
 import torch
 from .decode_head import BaseDecodeHead
-import numpy as np
 from mmcv.cnn import ConvModule, xavier_init, constant_init
 from .lib.fusion import AFF, iAFF
 from .lib.fem import PSA_p, PSA_s
 from .psp_head import PPM
-from mmseg.models.utils import SELayer
-torch.autograd.set_detect_anomaly(True)
+from mmseg.models.utils import SELayer, attention_pool, gated_sum
 
 class AttentionWeight(nn.Module):
 
@@ -17,21 +15,13 @@ class AttentionWeight(nn.Module):
         super(AttentionWeight, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
-        self.spatialPooling = nn.AdaptiveAvgPool3d((2, 1, 1))
-        self.scalePooling = nn.AdaptiveAvgPool2d(1)
         self.channel_agg = nn.Conv2d(in_channels, 1, kernel_size=1)
         self.trans = nn.Conv2d(self.in_channels, 1, 1)
 
     def forward(self, x):
-        x = self.spatialPooling(x.permute(0, 2, 1, 3, 4)).reshape(
-            x.size(0), x.size(2), 2, 1)
-        batch, channel, height, width = x.size() # B, C, 2, 1
-        channel_context = self.channel_agg(x)
-        channel_context = channel_context.view(batch, 1, height * width)
-        channel_context = F.softmax(channel_context, dim=-1)
-        channel_context = channel_context * height * width
-        channel_context = channel_context.view(batch, 1, height, width)
-        context = self.scalePooling(x * channel_context)
+        # B, 2, C, H, W -> B, C, 2, 1
+        x = x.mean(dim=(3, 4)).transpose(1, 2).unsqueeze(-1)
+        context = attention_pool(x, self.channel_agg(x))
         context = self.trans(context)
         return context
 
@@ -48,7 +38,8 @@ class FusionNode(nn.Module):
                  out_conv_order=('act', 'conv', 'norm'),
                  upsample_mode='bilinear',
                  op_num=2,
-                 upsample_attn=True):
+                 upsample_attn=True,
+                 share_weight=False):
         super(FusionNode, self).__init__()
         assert op_num == 2 or op_num == 3
         self.with_out_conv = with_out_conv
@@ -58,9 +49,9 @@ class FusionNode(nn.Module):
         act_cfg = None
         self.act_cfg = act_cfg
 
+        # one AttentionWeight per fusion step, or a single shared one
         self.weight = nn.ModuleList()
-        self.gap = nn.AdaptiveAvgPool2d(1)
-        for i in range(op_num - 1):
+        for i in range(1 if share_weight else op_num - 1):
             self.weight.append(
                 AttentionWeight(in_channels, in_channels))
             # constant_init(self.weight[-1], 0)
@@ -70,9 +61,7 @@ class FusionNode(nn.Module):
                 in_channels * 2, 1, kernel_size=3, padding=1, bias=True)
             self.temp = nn.Parameter(
                 torch.ones(1, dtype=torch.float32), requires_grad=True)
-            for m in self.spatial_weight.modules():
-                if isinstance(m, nn.Conv2d):
-                    constant_init(m, 0)
+            constant_init(self.spatial_weight, 0)
 
         if self.with_out_conv:
             self.post_fusion = ConvModule(
@@ -83,10 +72,8 @@ class FusionNode(nn.Module):
                 conv_cfg=out_conv_cfg,
                 norm_cfg=out_norm_cfg,
                 order=('act', 'conv', 'norm'))
-        if out_conv_cfg is None or out_conv_cfg['type'] == 'Conv2d':
-            for m in self.post_fusion.modules():
-                if isinstance(m, nn.Conv2d):
-                    xavier_init(m, distribution='uniform')
+            if out_conv_cfg is None or out_conv_cfg['type'] == 'Conv2d':
+                xavier_init(self.post_fusion.conv, distribution='uniform')
 
         if op_num > 2:
             self.pre_fusion = ConvModule(
@@ -98,15 +85,11 @@ class FusionNode(nn.Module):
                 norm_cfg=out_norm_cfg,
                 order=('act', 'conv', 'norm'))
             if out_conv_cfg is None or out_conv_cfg['type'] == 'Conv2d':
-                for m in self.pre_fusion.modules():
-                    if isinstance(m, nn.Conv2d):
-                        xavier_init(m, distribution='uniform')
+                xavier_init(self.pre_fusion.conv, distribution='uniform')
 
     def dynamicFusion(self, x):
         x1, x2 = x[0], x[1]
         batch, channel, height, width = x1.size()
-        # weight1 = self.gap(x1)
-        # weight2 = self.gap(x2)
         if self.upsample_attn:
             upsample_weight = (
                 self.temp * channel**(-0.5) *
@@ -118,16 +101,14 @@ class FusionNode(nn.Module):
         weight = torch.cat((x1.unsqueeze(1), x2.unsqueeze(1)), dim=1)
         weight = self.weight[0](weight)
         weight = torch.sigmoid(weight)
-        result = weight * x1 + (1 - weight) * x2
+        result = gated_sum(x1, x2, weight)
         if self.op_num == 3:
             x3 = x[2]
             x1 = self.pre_fusion(result)
-            # weight1 = self.gap(x1)
-            # weight3 = self.gap(x3)
             weight = torch.cat((x1.unsqueeze(1), x3.unsqueeze(1)), dim=1)
-            weight = self.weight[1](weight)
+            weight = self.weight[-1](weight)
             weight = torch.sigmoid(weight)
-            result = weight * x1 + (1 - weight) * x3
+            result = gated_sum(x1, x3, weight)
         if self.with_out_conv:
             result = self.post_fusion(result)
         return result
@@ -138,30 +119,48 @@ class FusionNode(nn.Module):
         elif x.shape[-2:] < size:
             return F.interpolate(x, size=size, mode=self.upsample_mode)
         else:
-            _, _, h, w = x.size()
-            x = F.max_pool2d(
-                F.pad(x, [0, w % 2, 0, h % 2], 'replicate'), (2, 2))
-            return x
+            return F.max_pool2d(x, kernel_size=2, stride=2, ceil_mode=True)
 
     def forward(self, x, out_size=None):
-        inputs = []
-        for feat in x:
-            inputs.append(self._resize(feat, out_size))
-        return self.dynamicFusion(inputs)
+        return self.dynamicFusion([self._resize(feat, out_size) for feat in x])
 
 
     
 @HEADS.register_module()
 class RPFNHead(BaseDecodeHead):
+    """Reverse pyramid fusion head.
+
+    Args:
+        start_level (int): Index of the first input feature level to use.
+            Default: 0.
+        end_level (int): Index after the last input feature level to use,
+            -1 means the last level. Default: -1.
+        norm_cfg (dict): Config dict for the normalization layers of the
+            lateral and fusion convs. Default: dict(type='BN',
+            requires_grad=True).
+        out_conv_cfg (dict): Config dict for the output convs of the fusion
+            nodes. Accepted for config compatibility but not passed on to
+            the fusion nodes yet. Default: None.
+        channels_last (bool): Whether to run the head in channels_last
+            (NHWC) memory format, which speeds up its many 1x1 convs on
+            GPUs with tensor cores. Default: False.
+        share_fusion_weight (bool): Whether the three-input fusion nodes
+            share one attention module between their two fusion steps.
+            Default: False.
+    """
 
     def __init__(self,
                  start_level=0,
                  end_level=-1,
                  norm_cfg=dict(type='BN', requires_grad=True),
-                 out_conv_cfg=None, **kwargs):
+                 out_conv_cfg=None,
+                 channels_last=False,
+                 share_fusion_weight=False,
+                 **kwargs):
         super(RPFNHead, self).__init__(input_transform='multiple_select', **kwargs)
         self.num_ins = len(self.in_channels)  # num of input feature levels
         self.norm_cfg = norm_cfg
+        self.channels_last = channels_last
 
         if end_level == -1:
             self.backbone_end_level = self.num_ins
@@ -200,12 +199,14 @@ class RPFNHead(BaseDecodeHead):
         self.RevFP['p5'] = FusionNode(
             in_channels=self.channels,
             out_channels=self.channels,
-            op_num=3, upsample_attn=True)
+            op_num=3, upsample_attn=True,
+            share_weight=share_fusion_weight)
 
         self.RevFP['p4'] = FusionNode(
             in_channels=self.channels,
             out_channels=self.channels,
-            op_num=3, upsample_attn=True)
+            op_num=3, upsample_attn=True,
+            share_weight=share_fusion_weight)
 
         self.RevFP['p3'] = FusionNode(
             in_channels=self.channels,
@@ -216,6 +217,32 @@ class RPFNHead(BaseDecodeHead):
         
         self.fusion_conv = ConvModule(self.channels * 4, self.channels,
                 kernel_size=1, padding=0, norm_cfg=norm_cfg)
+        # _fuse replays fusion_conv by hand and only supports this layout
+        assert self.fusion_conv.order == ('conv', 'norm', 'act')
+        assert type(self.fusion_conv.conv) is nn.Conv2d
+        assert not self.fusion_conv.with_explicit_padding
+        assert not self.fusion_conv.with_spectral_norm
+
+        if self.channels_last:
+            self.to(memory_format=torch.channels_last)
+
+    def _fuse(self, feats):
+        """Apply ``fusion_conv`` to the channel-wise concat of ``feats``.
+
+        The 1x1 conv over a concat equals the sum of 1x1 convs over each
+        input with the matching slice of the weight, so the concatenated
+        tensor is never materialized.
+        """
+        conv = self.fusion_conv.conv
+        weights = conv.weight.split(self.channels, dim=1)
+        output = F.conv2d(feats[0], weights[0], conv.bias)
+        for feat, weight in zip(feats[1:], weights[1:]):
+            output += F.conv2d(feat, weight)
+        if self.fusion_conv.with_norm:
+            output = self.fusion_conv.norm(output)
+        if self.fusion_conv.with_activation:
+            output = self.fusion_conv.activate(output)
+        return output
 
     def _resize(self, x, size):
         if x.shape[-2:] == size:
@@ -223,15 +250,17 @@ class RPFNHead(BaseDecodeHead):
         elif x.shape[-2:] < size:
             return F.interpolate(x, size=size, mode="bilinear", align_corners=False)
         else:
-            _, _, h, w = x.size()
-            x = F.max_pool2d(
-                F.pad(x, [0, w % 2, 0, h % 2], 'replicate'), (2, 2))
-            return x
+            return F.max_pool2d(x, kernel_size=2, stride=2, ceil_mode=True)
 
     def forward(self, inputs):
         """Forward function."""
         # build P3-P5
         inputs = self._transform_inputs(inputs)
+        if self.channels_last:
+            inputs = [
+                x.contiguous(memory_format=torch.channels_last)
+                for x in inputs
+            ]
         laterals = [
             lateral_conv(inputs[i + self.start_level])
             for i, lateral_conv in enumerate(self.lateral_convs)
@@ -242,20 +271,22 @@ class RPFNHead(BaseDecodeHead):
         
 
         # fixed order 
-        p3 = self.RevFP['p3']([c3, c4], out_size=c3.shape[-2:])
+        out_size = c3.shape[-2:]
+        p3 = self.RevFP['p3']([c3, c4], out_size=out_size)
         p4 = self.RevFP['p4']([c4, c5, p3], out_size=c4.shape[-2:])
         p5 = self.RevFP['p5']([c5, c6, p4], out_size=c5.shape[-2:])
         p6 = self.RevFP['p6']([c6, p5], out_size=c6.shape[-2:])
 
 
-        p4 = self._resize(p4, size=c3.shape[-2:])
-        p5 = self._resize(p5, size=c3.shape[-2:])
-        p6 = self._resize(p6, size=c3.shape[-2:])
+        # p3 is already at the c3 resolution
+        p4 = self._resize(p4, size=out_size)
+        p5 = self._resize(p5, size=out_size)
+        p6 = self._resize(p6, size=out_size)
         
 
 
         
-        output = self.fusion_conv(torch.cat([p3,p4,p5,p6], dim=1))
+        output = self._fuse([p3, p4, p5, p6])
         
 
         output = self.cls_seg(output)
@@ -1,4 +1,5 @@
 # Copyright (c) OpenMMLab. All rights reserved.
+from .attention_fusion import attention_pool, gated_sum
 from .embed import PatchEmbed
 from .inverted_residual import InvertedResidual, InvertedResidualV3
 from .make_divisible import make_divisible
@@ -18,5 +19,6 @@ __all__ = [
     'UpConvBlock', 'InvertedResidualV3', 'SELayer', 'PatchEmbed',
     'nchw_to_nlc', 'nlc_to_nchw', 'nchw2nlc2nchw', 'nlc2nchw2nlc',
     'VisualAttention', 'wVisualAttention', 'LayerAttention', 'EfficientSELayer',
-    'EfficientLayerAttn', 'GeSELayer'
+    'EfficientLayerAttn', 'GeSELayer', 'attention_pool',
+    'gated_sum'
 ]
@@ -0,0 +1,46 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import torch
+import torch.nn.functional as F
+
+
+def attention_pool(x, channel_context):
+    """Sum ``x`` over H, W weighted by a spatial softmax of
+    ``channel_context``.
+
+    Equals ``avg_pool(x * softmax(channel_context) * H * W)`` but runs as a
+    single matmul without the rescale or the reweighted intermediate.
+
+    Args:
+        x (Tensor): Feature map of shape (B, C, H, W).
+        channel_context (Tensor): Attention logits of shape (B, 1, H, W).
+
+    Returns:
+        Tensor: The pooled context of shape (B, C, 1, 1).
+    """
+    batch, channel, height, width = x.size()
+    channel_context = F.softmax(
+        channel_context.view(batch, height * width, 1), dim=1)
+    context = torch.matmul(
+        x.reshape(batch, channel, height * width), channel_context)
+    return context.view(batch, channel, 1, 1)
+
+
+def gated_sum(x1, x2, weight):
+    """Blend two feature maps as ``weight * x1 + (1 - weight) * x2``.
+
+    The blend runs as a single ``torch.lerp``. ``lerp`` does no type
+    promotion, so all operands are first cast to their promoted dtype, which
+    keeps mixed fp16/fp32 inputs (e.g. under autocast) working like the plain
+    arithmetic form.
+
+    Args:
+        x1 (Tensor): Feature map selected where ``weight`` is 1.
+        x2 (Tensor): Feature map selected where ``weight`` is 0.
+        weight (Tensor): Gate broadcastable to ``x1`` and ``x2``.
+
+    Returns:
+        Tensor: The blended feature map.
+    """
+    dtype = torch.promote_types(
+        torch.promote_types(x1.dtype, x2.dtype), weight.dtype)
+    return torch.lerp(x2.to(dtype), x1.to(dtype), weight.to(dtype))
@@ -0,0 +1,29 @@
+# Copyright (c) OpenMMLab. All rights reserved.
+import torch
+
+from mmseg.models.utils import attention_pool, gated_sum
+
+
+def test_attention_pool():
+    x = torch.rand(2, 4, 3, 5)
+    channel_context = torch.rand(2, 1, 3, 5)
+    output = attention_pool(x, channel_context)
+    assert output.shape == torch.Size((2, 4, 1, 1))
+
+    softmax = torch.softmax(channel_context.view(2, 1, -1), dim=-1)
+    expected = (x * softmax.view(2, 1, 3, 5) * 15).mean(
+        dim=(2, 3), keepdim=True)
+    assert torch.allclose(output, expected, atol=1e-6)
+
+
+def test_gated_sum():
+    x1 = torch.rand(2, 4, 5, 5)
+    x2 = torch.rand(2, 4, 5, 5)
+    weight = torch.rand(2, 1, 1, 1)
+    output = gated_sum(x1, x2, weight)
+    assert torch.allclose(output, weight * x1 + (1 - weight) * x2)
+
+    # mixed dtypes are promoted like the arithmetic form
+    output = gated_sum(x1.half(), x2, weight.half())
+    assert output.dtype == torch.float32
+    assert output.shape == x1.shape